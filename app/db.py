@@ -1,16 +1,20 @@
 from __future__ import annotations
 
-import json
 import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Iterator, Optional
+
+import orjson
 
 # Project root is one level above /app
 BASE_DIR = Path(__file__).resolve().parent.parent
 DATA_DIR = BASE_DIR / "data"
 DB_PATH = DATA_DIR / "storyteller.db"
 
+# Reference only; never mutate it. Sessions get their own copy from fresh_state().
 DEFAULT_STATE = {
     "location": "starting_area",
     "inventory": [],
@@ -19,36 +23,119 @@ DEFAULT_STATE = {
 }
 
 
+def fresh_state() -> dict[str, Any]:
+    return {
+        "location": "starting_area",
+        "inventory": [],
+        "flags": {},
+        "relationships": {},
+    }
+
+
+# Connection tuning. WAL lets readers run alongside the single writer, and
+# synchronous=NORMAL is safe under WAL (only checkpoints fsync the main file).
+_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-20000",
+)
+
+# One connection is shared by the whole process so the page cache stays warm
+# between turns. Endpoints may call in from worker threads, so writes are
+# serialised with a lock.
+_CONN: Optional[sqlite3.Connection] = None
+_CONN_LOCK = threading.Lock()
+_WRITE_LOCK = threading.Lock()
+
+
 def get_conn() -> sqlite3.Connection:
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    global _CONN
+
+    if _CONN is not None:
+        return _CONN
+
+    with _CONN_LOCK:
+        if _CONN is None:
+            DATA_DIR.mkdir(parents=True, exist_ok=True)
+            # isolation_level=None: we issue BEGIN/COMMIT ourselves (see _write_txn).
+            conn = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
 
+            # journal_mode=WAL is persisted in the database file; the rest
+            # apply to this connection only.
+            conn.execute("PRAGMA journal_mode=WAL")
+            for pragma in _PRAGMAS:
+                conn.execute(pragma)
 
-def _columns(conn: sqlite3.Connection, table: str) -> set[str]:
+            _CONN = conn
+
+    return _CONN
+
+
+@contextmanager
+def _write_txn(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """
+    Serialised write transaction. BEGIN IMMEDIATE takes SQLite's write lock
+    up front, so a concurrent reader can't force a SQLITE_BUSY upgrade
+    partway through.
+    """
+    with _WRITE_LOCK:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            # A failed COMMIT can leave the transaction open (or SQLite may
+            # have rolled it back already); never leave the shared
+            # connection stuck inside one.
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+
+# history_json/state_json hold orjson output as raw UTF-8 bytes.
+_SESSIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS sessions (
+        session_id   TEXT PRIMARY KEY,
+        history_json BLOB NOT NULL,
+        story_text   TEXT NOT NULL,
+        state_json   BLOB NOT NULL,
+        created_at   TEXT NOT NULL,
+        updated_at   TEXT NOT NULL
+    )
+"""
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> dict[str, str]:
+    """
+    Map of column name -> declared type.
+    """
     rows = conn.execute(f"PRAGMA table_info({table})").fetchall()
-    return {r["name"] for r in rows}
+    return {r["name"]: r["type"].upper() for r in rows}
+
+
+_INITIALISED = False
 
 
 def init_db() -> None:
     """
     Create table if missing, and add any missing columns (migration-safe).
     This allows you to upgrade without deleting your existing storyteller.db.
+    Runs once per process, as a single transaction; later calls are no-ops.
     """
-    with get_conn() as conn:
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS sessions (
-                session_id   TEXT PRIMARY KEY,
-                history_json TEXT NOT NULL,
-                story_text   TEXT NOT NULL,
-                state_json   TEXT NOT NULL,
-                created_at   TEXT NOT NULL,
-                updated_at   TEXT NOT NULL
-            )
-            """
-        )
+    global _INITIALISED
+
+    if _INITIALISED:
+        return
+
+    conn = get_conn()
+
+    with _write_txn(conn):
+        if _INITIALISED:
+            return
+
+        conn.execute(_SESSIONS_DDL)
 
         cols = _columns(conn, "sessions")
 
@@ -63,13 +150,34 @@ def init_db() -> None:
         if "updated_at" not in cols:
             conn.execute("ALTER TABLE sessions ADD COLUMN updated_at TEXT NOT NULL DEFAULT ''")
 
+        # Older DBs stored the JSON columns as TEXT. SQLite can't change a
+        # column's type in place, so rebuild the table with BLOB columns.
+        cols = _columns(conn, "sessions")
+        if cols["history_json"] != "BLOB" or cols["state_json"] != "BLOB":
+            conn.execute("ALTER TABLE sessions RENAME TO sessions_old")
+            conn.execute(_SESSIONS_DDL)
+            conn.execute(
+                """
+                INSERT INTO sessions (session_id, history_json, story_text, state_json, created_at, updated_at)
+                SELECT session_id, CAST(history_json AS BLOB), story_text, CAST(state_json AS BLOB),
+                       created_at, updated_at
+                FROM sessions_old
+                """
+            )
+            conn.execute("DROP TABLE sessions_old")
+
         # Backfill state_json for any existing rows that might have '{}' or NULL-ish values
         conn.execute(
-            "UPDATE sessions SET state_json = ? WHERE state_json IS NULL OR state_json = '' OR state_json = '{}'",
-            (json.dumps(DEFAULT_STATE, ensure_ascii=False),),
+            "UPDATE sessions SET state_json = ? WHERE state_json IS NULL OR CAST(state_json AS TEXT) IN ('', '{}')",
+            (orjson.dumps(DEFAULT_STATE),),
         )
 
-        conn.commit()
+    _INITIALISED = True
+
+
+def _ensure_init() -> None:
+    if not _INITIALISED:
+        init_db()
 
 
 def migrate_add_state_column() -> None:
@@ -80,20 +188,17 @@ def migrate_add_state_column() -> None:
 
 
 def save_session(session_id: str, history: list[dict[str, Any]], story_text: str, state: dict[str, Any]) -> None:
-    init_db()
+    _ensure_init()
     now = datetime.utcnow().isoformat()
 
-    history_json = json.dumps(history, ensure_ascii=False)
-    state_json = json.dumps(state, ensure_ascii=False)
-
-    with get_conn() as conn:
-        existing = conn.execute(
-            "SELECT created_at FROM sessions WHERE session_id = ?",
-            (session_id,),
-        ).fetchone()
+    history_json = orjson.dumps(history)
+    state_json = orjson.dumps(state)
 
-        created_at = existing["created_at"] if existing and existing["created_at"] else now
+    conn = get_conn()
 
+    # created_at is left out of the UPDATE branch, so an existing row keeps
+    # its original value and `now` only lands on first insert.
+    with _write_txn(conn):
         conn.execute(
             """
             INSERT INTO sessions (session_id, history_json, story_text, state_json, created_at, updated_at)
@@ -104,33 +209,30 @@ def save_session(session_id: str, history: list[dict[str, Any]], story_text: str
                 state_json   = excluded.state_json,
                 updated_at   = excluded.updated_at
             """,
-            (session_id, history_json, story_text, state_json, created_at, now),
+            (session_id, history_json, story_text, state_json, now, now),
         )
-        conn.commit()
 
 
 def load_session(session_id: str) -> Optional[dict[str, Any]]:
-    init_db()
+    _ensure_init()
 
-    with get_conn() as conn:
-        row = conn.execute(
-            "SELECT * FROM sessions WHERE session_id = ?",
-            (session_id,),
-        ).fetchone()
+    # init_db guarantees every column exists, so read them by position.
+    row = get_conn().execute(
+        "SELECT session_id, history_json, story_text, state_json FROM sessions WHERE session_id = ?",
+        (session_id,),
+    ).fetchone()
 
     if not row:
         return None
 
-    keys = set(row.keys())
-
-    history = json.loads(row["history_json"]) if "history_json" in keys and row["history_json"] else []
-    story_text = row["story_text"] if "story_text" in keys and row["story_text"] else ""
+    history = orjson.loads(row[1]) if row[1] else []
+    story_text = row[2] or ""
 
-    raw_state = row["state_json"] if "state_json" in keys and row["state_json"] else ""
+    raw_state = row[3] or b""
     try:
-        state = json.loads(raw_state) if raw_state else DEFAULT_STATE.copy()
-    except json.JSONDecodeError:
-        state = DEFAULT_STATE.copy()
+        state = orjson.loads(raw_state) if raw_state else fresh_state()
+    except orjson.JSONDecodeError:
+        state = fresh_state()
 
     # Ensure required keys exist (future-proof)
     state.setdefault("location", "starting_area")
@@ -139,7 +241,7 @@ def load_session(session_id: str) -> Optional[dict[str, Any]]:
     state.setdefault("relationships", {})
 
     return {
-        "session_id": row["session_id"],
+        "session_id": row[0],
         "history": history,
         "story_text": story_text,
         "state": state,
@@ -1,46 +1,298 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import Receive, Scope, Send
 from pathlib import Path
 from pydantic import BaseModel
-from fastapi.responses import StreamingResponse
-from app.db import init_db, save_session, load_session
+from app.db import fresh_state, init_db, save_session, load_session
 
-import json
-import copy
+import asyncio
+import hashlib
+from collections import OrderedDict
 import httpx
+import logging
+import orjson
+import re
+import time
+import weakref
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
-# Initialize DB on startup
+logger = logging.getLogger(__name__)
+
+# NDJSON token streams. GZipMiddleware doesn't flush between chunks, so
+# compressing these would hold tokens back until its buffer fills.
+STREAMING_PATHS = frozenset({"/api/story/new_stream", "/api/story/turn_stream"})
+
+
+class StoryGZipMiddleware(GZipMiddleware):
+    """
+    GZip for transcript-sized JSON responses and static assets, leaving the
+    token streams uncompressed.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"] in STREAMING_PATHS:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+# Level 5: most of level 9's ratio on prose, for a fraction of the CPU.
+app.add_middleware(StoryGZipMiddleware, minimum_size=1024, compresslevel=5)
+
+OLLAMA_BASE_URL = "http://localhost:11434"
+
+# Keep the model loaded between turns, so Ollama can reuse the KV cache for
+# the shared prompt prefix instead of reloading and re-prefilling everything.
+OLLAMA_KEEP_ALIVE = "30m"
+
+# Request bodies are pre-encoded with orjson and sent as content=, so httpx
+# doesn't run the (growing) prompt through stdlib json.
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+# Initialize DB, the shared Ollama client and the session writer on startup.
+# Every handler goes through app.state.http, so turns reuse keep-alive
+# connections to Ollama instead of opening a new socket per request.
 @app.on_event("startup")
-def _startup():
+async def _startup():
     init_db()
+    app.state.index_html = load_index_html()
+    app.state.http = httpx.AsyncClient(
+        base_url=OLLAMA_BASE_URL,
+        timeout=60.0,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.0),
+    )
+    app.state.stop_session_writer = asyncio.Event()
+    app.state.session_writer = asyncio.create_task(write_sessions_forever(app.state.stop_session_writer))
+
+
+@app.on_event("shutdown")
+async def _shutdown():
+    # Compactions still in flight would need the HTTP client and could mark
+    # sessions dirty after the last flush; cancel them first (an unsummarised
+    # history is compacted again after its next turn).
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+
+    # Not cancelled: a cancel could land mid-save. Stopping lets the writer
+    # finish its current save and run one last flush.
+    app.state.stop_session_writer.set()
+    await app.state.session_writer
+    await app.state.http.aclose()
 
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 WEB_DIR = BASE_DIR / "web"
 
-app.mount("/static", StaticFiles(directory=WEB_DIR), name="static")
+STATIC_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# src="/static/..." / href="/static/..." references in index.html
+STATIC_REF_RE = re.compile(rb'(src|href)="/static/([^"?#]+)"')
+
+
+class CachedStaticFiles(StaticFiles):
+    """
+    StaticFiles with a long-lived, immutable Cache-Control. That's safe
+    because index.html links each asset with a content-hash query string
+    (see load_index_html), so a changed file gets a new URL.
+    """
+
+    def file_response(self, *args, **kwargs) -> Response:
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = STATIC_CACHE_CONTROL
+        return response
+
+
+def load_index_html() -> bytes:
+    """
+    Read index.html once, adding ?v=<content hash> to its /static/ links.
+    """
+    def versioned(m: re.Match) -> bytes:
+        path = WEB_DIR / m.group(2).decode()
+        if not path.is_file():
+            return m.group(0)
+        digest = hashlib.sha256(path.read_bytes()).hexdigest()[:12]
+        return b'%s="/static/%s?v=%s"' % (m.group(1), m.group(2), digest.encode())
+
+    return STATIC_REF_RE.sub(versioned, (WEB_DIR / "index.html").read_bytes())
+
+
+app.mount("/static", CachedStaticFiles(directory=WEB_DIR), name="static")
 
 
 # ----------------------------
-# Simple in-memory session store
+# In-memory session cache (LRU + idle TTL, backed by the DB)
 # ----------------------------
 # sessions[session_id] = {
 #   "history": [{"role": "system"/"user"/"assistant", "content": "..."}],
-#   "story_text": "..."
+#   "story_text": "...",
+#   "state": {...},
+#   "transcript": "...",  # build_transcript(history), kept up to date per turn
+#   "last_used": 0.0,     # time.monotonic() of the last access
 # }
+#
+# Changes are written behind: handlers call mark_dirty() and return without
+# waiting on SQLite, and a background task saves dirty sessions every
+# SAVE_INTERVAL_SECONDS (and once more on shutdown). Sessions with a turn
+# in progress are never evicted, and evicting any other session is safe:
+# get_session() takes it back from the pending or in-flight writes, or
+# reloads it from the DB. The dict is kept in least-recently-used order, so
+# both size and idle-time eviction pop from the front. All access happens on
+# the event loop thread, so no lock.
+
+MAX_SESSIONS = 256
+SESSION_TTL_SECONDS = 3600
+
+sessions: OrderedDict[str, dict] = OrderedDict()
+
+
+def _busy(session_id: str) -> bool:
+    lock = _session_locks.get(session_id)
+    return lock is not None and lock.locked()
+
 
-sessions: dict[str, dict] = {}
+def _evict(now: float) -> None:
+    # Sessions with a turn in progress are skipped: the turn still holds the
+    # object, and a reload from the DB would miss its reply.
+    busy = []
+    while sessions:
+        session_id, oldest = next(iter(sessions.items()))
+        if len(sessions) + len(busy) <= MAX_SESSIONS and now - oldest["last_used"] < SESSION_TTL_SECONDS:
+            break
+        sessions.popitem(last=False)
+        if _busy(session_id):
+            busy.append((session_id, oldest))
+    for session_id, session in reversed(busy):
+        sessions[session_id] = session
+        sessions.move_to_end(session_id, last=False)
 
 
-DEFAULT_STATE = {
-    "location": "starting_area",
-    "inventory": [],
-    "flags": {},
-    "relationships": {},
-}
+def _touch(session_id: str) -> dict | None:
+    now = time.monotonic()
+    _evict(now)
+    session = sessions.get(session_id)
+    if session is not None:
+        session["last_used"] = now
+        sessions.move_to_end(session_id)
+    return session
+
+
+def _remember(session_id: str, session: dict) -> dict:
+    now = time.monotonic()
+    session["last_used"] = now
+    sessions[session_id] = session
+    sessions.move_to_end(session_id)
+    _evict(now)
+    return session
+
+
+SAVE_INTERVAL_SECONDS = 0.5
+
+# session_id -> session with changes not yet in the DB, and session_id ->
+# session whose save is in flight. Holding the session itself (not just the
+# id) keeps unsaved changes alive through eviction until the write commits.
+_dirty: dict[str, dict] = {}
+_saving: dict[str, dict] = {}
+
+
+def mark_dirty(session_id: str, session: dict) -> None:
+    _dirty[session_id] = session
+
+
+def pending_session(session_id: str) -> dict | None:
+    """
+    Session with changes that aren't committed to the DB yet, if any.
+    """
+    return _dirty.get(session_id) or _saving.get(session_id)
+
+
+async def flush_sessions() -> None:
+    while _dirty:
+        session_id, session = _dirty.popitem()
+        _saving[session_id] = session
+        saved = False
+        try:
+            await asyncio.to_thread(
+                save_session, session_id, stored_history(session["history"]), session["story_text"], session["state"]
+            )
+            saved = True
+        except Exception:
+            logger.exception("Saving session %s failed", session_id)
+            return
+        finally:
+            if _saving.get(session_id) is session:
+                del _saving[session_id]
+            if not saved:
+                # Keep it queued (unless a newer session replaced it) and retry next tick.
+                _dirty.setdefault(session_id, session)
+
+
+async def write_sessions_forever(stop: asyncio.Event) -> None:
+    """
+    Flush every SAVE_INTERVAL_SECONDS until stop is set, then flush once more.
+    """
+    while True:
+        try:
+            await asyncio.wait_for(stop.wait(), SAVE_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        await flush_sessions()
+        if stop.is_set():
+            return
+
+
+# Turns on the same session are serialised with a per-session lock, so two
+# actions can't interleave their history appends. Locks live only while a
+# turn holds or waits on them (weak values), so the map doesn't grow.
+_session_locks: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
+
+# Identical concurrent turns (e.g. a double-clicked action) share a single
+# generation instead of running it twice: (session_id, action hash) -> result.
+_inflight: dict[tuple[str, str], asyncio.Future] = {}
+
+
+def session_lock(session_id: str) -> asyncio.Lock:
+    lock = _session_locks.get(session_id)
+    if lock is None:
+        lock = _session_locks[session_id] = asyncio.Lock()
+    return lock
+
+
+def turn_key(session_id: str, action: str) -> tuple[str, str]:
+    return session_id, hashlib.blake2b(action.encode(), digest_size=16).hexdigest()
+
+
+async def run_once(key: tuple[str, str], fn):
+    """
+    Await fn(), unless a call with the same key is already running, in which
+    case wait for that call's result (or exception) instead.
+    """
+    pending = _inflight.get(key)
+    if pending is not None:
+        # shield: a waiter going away must not cancel the shared result
+        return await asyncio.shield(pending)
+
+    future = asyncio.get_running_loop().create_future()
+    # Mark a failure as retrieved even if nobody else was waiting on it.
+    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+    _inflight[key] = future
+    try:
+        result = await fn()
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        del _inflight[key]
 
 
 # ----------------------------
@@ -69,63 +321,162 @@ class StoryTurnRequest(BaseModel):
 # ----------------------------
 @app.get("/health")
 def health():
-    return {"ok": True}
+    return {"ok": True, "sessions": len(sessions)}
 
 
 @app.get("/")
 def index():
-    return FileResponse(WEB_DIR / "index.html")
+    # Served from memory; no-cache so browsers revalidate and pick up new asset hashes.
+    return Response(app.state.index_html, media_type="text/html", headers={"Cache-Control": "no-cache"})
 
 
 # ----------------------------
 # Ollama helper
 # ----------------------------
 async def call_ollama(prompt: str, model: str) -> str:
-    ollama_url = "http://localhost:11434/api/generate"
-    payload = {"model": model, "prompt": prompt, "stream": False}
+    ollama_url = f"{OLLAMA_BASE_URL}/api/generate"
+    body = orjson.dumps({"model": model, "prompt": prompt, "stream": False, "keep_alive": OLLAMA_KEEP_ALIVE})
 
     try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            r = await client.post(ollama_url, json=payload)
-            r.raise_for_status()
-            data = r.json()
-            return data.get("response", "")
+        r = await app.state.http.post("/api/generate", content=body, headers=JSON_HEADERS)
+        r.raise_for_status()
+        data = orjson.loads(r.content)
+        return data.get("response", "")
     except httpx.HTTPStatusError as e:
         raise HTTPException(status_code=502, detail=f"Ollama error: {e.response.text}")
     except httpx.RequestError as e:
         raise HTTPException(status_code=502, detail=f"Cannot reach Ollama at {ollama_url}: {str(e)}")
 
-async def stream_ollama(prompt: str, model: str):
+def _parse_ndjson_line(line: bytes):
+    if not line.strip():
+        return None
+    try:
+        return orjson.loads(line)
+    except orjson.JSONDecodeError:
+        return None
+
+
+async def aiter_ndjson(r: httpx.Response):
     """
-    Yields incremental text chunks from Ollama (/api/generate with stream=True).
-    Ollama returns JSON lines like: {"response":"...", "done":false}
+    Yields parsed objects from an NDJSON response body.
+    Lines are split out of the raw bytes and handed straight to orjson, which
+    skips the per-line str decode of aiter_lines(). Unparseable lines are skipped.
     """
-    ollama_url = "http://localhost:11434/api/generate"
-    payload = {"model": model, "prompt": prompt, "stream": True}
+    buffer = bytearray()
+
+    async for chunk in r.aiter_bytes():
+        buffer += chunk
+        start = 0
+        while (nl := buffer.find(b"\n", start)) != -1:
+            data = _parse_ndjson_line(bytes(buffer[start:nl]))
+            start = nl + 1
+            if data is not None:
+                yield data
+        del buffer[:start]
+
+    data = _parse_ndjson_line(bytes(buffer))
+    if data is not None:
+        yield data
+
+
+async def call_ollama_chat(messages: list[dict], model: str) -> str:
+    """
+    One-shot reply from Ollama's /api/chat for a list of role/content
+    messages (see chat_messages). Ollama applies the model's chat template
+    itself.
+    """
+    ollama_url = f"{OLLAMA_BASE_URL}/api/chat"
+    body = orjson.dumps({"model": model, "messages": messages, "stream": False, "keep_alive": OLLAMA_KEEP_ALIVE})
+
+    try:
+        r = await app.state.http.post("/api/chat", content=body, headers=JSON_HEADERS)
+        r.raise_for_status()
+        data = orjson.loads(r.content)
+        return (data.get("message") or {}).get("content", "")
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=502, detail=f"Ollama error: {e.response.text}")
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=502, detail=f"Cannot reach Ollama at {ollama_url}: {str(e)}")
+
+
+async def stream_ollama_chat(messages: list[dict], model: str):
+    """
+    Yields incremental text chunks from Ollama (/api/chat with stream=True).
+    Ollama returns JSON lines like:
+    {"message": {"role": "assistant", "content": "..."}, "done": false}
+    """
+    ollama_url = f"{OLLAMA_BASE_URL}/api/chat"
+    body = orjson.dumps({"model": model, "messages": messages, "stream": True, "keep_alive": OLLAMA_KEEP_ALIVE})
 
     try:
-        async with httpx.AsyncClient(timeout=None) as client:
-            async with client.stream("POST", ollama_url, json=payload) as r:
-                r.raise_for_status()
-                async for line in r.aiter_lines():
-                    if not line:
-                        continue
-                    try:
-                        data = json.loads(line)
-                    except json.JSONDecodeError:
-                        continue
-
-                    if data.get("response"):
-                        yield data["response"]
-
-                    if data.get("done") is True:
-                        break
+        async with app.state.http.stream("POST", "/api/chat", content=body, headers=JSON_HEADERS, timeout=None) as r:
+            r.raise_for_status()
+            async for data in aiter_ndjson(r):
+                text = (data.get("message") or {}).get("content")
+                if text:
+                    yield text
+                if data.get("done"):
+                    break
 
     except httpx.HTTPStatusError as e:
         raise HTTPException(status_code=502, detail=f"Ollama error: {e.response.text}")
     except httpx.RequestError as e:
         raise HTTPException(status_code=502, detail=f"Cannot reach Ollama at {ollama_url}: {str(e)}")
 
+
+# Streamed tokens are coalesced into NDJSON frames; a frame goes out once its
+# oldest token is this old or it holds this many, so we aren't encoding and
+# flushing one frame per model token.
+STREAM_FLUSH_SECONDS = 0.03
+STREAM_FLUSH_CHUNKS = 16
+
+
+async def batch_chunks(chunks):
+    """
+    Re-yields text from an async chunk iterator, joined into batches.
+    A batch is flushed once its oldest chunk is STREAM_FLUSH_SECONDS old
+    (even if no further chunk arrives) or it holds STREAM_FLUSH_CHUNKS
+    chunks, and whatever is left is flushed at the end.
+    """
+    loop = asyncio.get_running_loop()
+    it = chunks.__aiter__()
+    buf = []
+    deadline = 0.0
+    # The next chunk is fetched in a task, so the flush timer can wait on
+    # it without cancelling (and so closing) the underlying stream.
+    pending = None
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(it.__anext__())
+            if buf:
+                done, _ = await asyncio.wait({pending}, timeout=max(deadline - loop.time(), 0))
+                if not done:
+                    yield "".join(buf)
+                    buf = []
+                    continue
+
+            try:
+                chunk = await pending
+            except StopAsyncIteration:
+                break
+            finally:
+                pending = None
+
+            if not buf:
+                deadline = loop.time() + STREAM_FLUSH_SECONDS
+            buf.append(chunk)
+            if len(buf) >= STREAM_FLUSH_CHUNKS:
+                yield "".join(buf)
+                buf = []
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+    if buf:
+        yield "".join(buf)
+
 # ----------------------------
 # Existing simple generate API (still handy)
 # ----------------------------
@@ -144,7 +495,7 @@ Write vivid, coherent story text in 2nd person present tense.
 Keep each response 120-220 words.
 Always end with exactly 3 numbered choices (1, 2, 3), each 8-14 words.
 Do not mention you are an AI. Do not break character.
-"""
+""".strip()
 
 
 def format_state(state: dict) -> str:
@@ -164,32 +515,81 @@ def format_state(state: dict) -> str:
     )
 
 
-def build_prompt(history: list[dict], state: dict) -> str:
+# Messages carry their formatted forms from the moment they're added:
+# "_chat" is the plain {"role", "content"} dict sent to /api/chat (without
+# our bookkeeping keys) and "_transcript_line" is the transcript line, so
+# rebuilding either only collects ready values. Like every "_" key they live
+# in memory only: stored_history drops them and prepare_history rebuilds
+# them on load.
+CHAT_ROLES = frozenset({"system", "user", "assistant"})
+TRANSCRIPT_PREFIXES = {"user": "> You: ", "assistant": ""}
+
+
+def format_message(msg: dict) -> dict:
     """
-    Turn a role/content history into a single prompt string for /api/generate.
-    (Simple approach for now; later we can switch to chat format.)
+    Fill in the cached chat/transcript forms of a message (in place).
     """
-    out = []
-    injected_state = False
+    role = msg["role"]
+    content = msg["content"].strip()
+    if msg.get("summarized"):
+        # Folded into the "Story so far" summary; transcript only.
+        msg["_chat"] = None
+    else:
+        msg["_chat"] = {"role": role, "content": content} if role in CHAT_ROLES else None
+    msg["_transcript_line"] = TRANSCRIPT_PREFIXES[role] + content if role in TRANSCRIPT_PREFIXES else None
+    return msg
 
-    for msg in history:
-        role = msg["role"]
-        content = msg["content"].strip()
 
-        if role == "system":
-            out.append(content)
-            if not injected_state:
-                out.append("\n" + format_state(state).strip())
-                injected_state = True
+def make_message(role: str, content: str) -> dict:
+    return format_message({"role": role, "content": content})
+
+
+def stored_history(history: list[dict]) -> list[dict]:
+    """
+    Copy of a history for the DB, without the cached "_" keys; those
+    duplicate each message's content and prepare_history rebuilds them.
+    """
+    return [{k: v for k, v in msg.items() if not k.startswith("_")} for msg in history]
+
 
-        elif role == "user":
-            out.append(f"\nUser: {content}")
+def bake_state(history: list[dict], state: dict) -> None:
+    """
+    Render the world state into the system message's chat form, so
+    chat_messages doesn't reformat it every turn. Call again whenever the
+    state changes. The baked copy is in memory only (stored_history drops
+    it); the session's state is what gets saved.
+    """
+    if history and history[0]["role"] == "system":
+        system = history[0]
+        content = system["content"].strip() + "\n\n" + format_state(state).strip()
+        system["_chat"] = {"role": "system", "content": content}
 
-        elif role == "assistant":
-            out.append(f"\nAssistant: {content}")
 
-    out.append("\nAssistant:")
-    return "\n".join(out).strip()
+def prepare_history(history: list[dict], state: dict) -> list[dict]:
+    """
+    Fill in the cached forms for a history loaded from the DB, which never
+    stores them, and bake in the session's saved state.
+    """
+    for msg in history:
+        format_message(msg)
+    bake_state(history, state)
+    return history
+
+
+def chat_messages(history: list[dict]) -> list[dict]:
+    """
+    The /api/chat messages for a history: system prompt + world state, then
+    the turns in order, skipping anything folded into the summary.
+    Every message must already be formatted (make_message/prepare_history),
+    with the world state baked into the system message (bake_state).
+
+    Layout is static-first, dynamic-last, so each turn's templated prompt
+    starts with the previous turn's byte-for-byte, which is what lets Ollama
+    reuse its KV cache. Never put timestamps, session ids or anything else
+    per-request ahead of the history; a state change re-bakes the system
+    message and costs one full prefill.
+    """
+    return [msg["_chat"] for msg in history if msg["_chat"] is not None]
 
 
 # ----------------------------
@@ -198,155 +598,308 @@ def build_prompt(history: list[dict], state: dict) -> str:
 def build_transcript(history: list[dict]) -> str:
     parts = []
     for msg in history:
-        role = msg["role"]
-        content = msg["content"].strip()
-        if role == "system":
-            continue
-        if role == "user":
-            parts.append(f"> You: {content}")
-        elif role == "assistant":
-            parts.append(content)
+        if msg["_transcript_line"]:
+            parts.append(msg["_transcript_line"])
     return "\n\n".join(parts).strip()
 
 
+def extend_transcript(transcript: str, msg: dict) -> str:
+    """
+    Append one message to a transcript built by build_transcript, so sessions
+    can keep theirs up to date instead of rebuilding it every request.
+    Empty lines are skipped (as in build_transcript), so the result never
+    needs stripping and endpoints can return it as-is.
+    """
+    line = msg["_transcript_line"]
+    if not line:
+        return transcript
+    return f"{transcript}\n\n{line}" if transcript else line
+
+
+def get_session(session_id: str) -> dict | None:
+    """
+    Session from the in-memory cache, falling back to the DB.
+    """
+    session = _touch(session_id)
+    if session is not None:
+        return session
+
+    # Evicted with unsaved changes: the DB row would be stale.
+    pending = pending_session(session_id)
+    if pending is not None:
+        return _remember(session_id, pending)
+
+    db_row = load_session(session_id)
+    if not db_row:
+        return None
+
+    state = db_row.get("state") or fresh_state()
+    history = prepare_history(db_row["history"], state)
+
+    return _remember(session_id, {
+        "history": history,
+        "story_text": db_row.get("story_text", ""),
+        "state": state,
+        "transcript": build_transcript(history),
+    })
+
+
 @app.post("/api/story/get")
 async def story_get(req: StoryGetRequest):
-    session = sessions.get(req.session_id)
-
-    # If not in memory, try DB
+    session = get_session(req.session_id)
     if not session:
-        db_row = load_session(req.session_id)
-        if not db_row:
-            return {"story": ""}
+        return {"story": ""}
+
+    return {"story": session["transcript"]}
+
+
+def start_session(session_id: str, history: list[dict], state: dict, story: str) -> dict:
+    """
+    Add the opening reply to a new history and cache the session.
+    """
+    history.append(make_message("assistant", story))
+    return _remember(session_id, {
+        "history": history,
+        "story_text": story,
+        "state": state,
+        "transcript": build_transcript(history),
+    })
+
+
+def record_turn(session: dict, user_msg: dict, story: str) -> None:
+    """
+    Append a finished user/assistant exchange to the session. Both messages
+    go in together, so a failed or abandoned generation never leaves a
+    dangling user message in the history.
+    """
+    assistant_msg = make_message("assistant", story)
+    session["history"].append(user_msg)
+    session["history"].append(assistant_msg)
+    session["story_text"] = story
+    session["transcript"] = extend_transcript(extend_transcript(session["transcript"], user_msg), assistant_msg)
+
+
+# ----------------------------
+# History compaction
+# ----------------------------
+# Every turn re-sends the whole history, so prompts grow without bound. Once
+# more than HISTORY_MAX_TURNS exchanges are live, all but the newest
+# HISTORY_KEEP_TURNS are summarised (in the background) into one
+# "Story so far" system message pinned right after the system prompt. The
+# folded messages stay in the history, flagged "summarized", so the
+# transcript and the DB still have the full story; they just drop out of
+# the prompt.
+HISTORY_MAX_TURNS = 12
+HISTORY_KEEP_TURNS = 6
+
+SUMMARY_INSTRUCTIONS = (
+    "Summarize the story so far in at most 200 words. Keep the key events, "
+    "characters, places and unresolved threads. Write plain prose, no choices."
+)
+
+# Strong references to running background tasks (asyncio only keeps weak ones).
+_background_tasks: set[asyncio.Task] = set()
+
+
+def _has_summary(history: list[dict]) -> bool:
+    return len(history) > 1 and history[1].get("summary", False)
 
-        sessions[req.session_id] = {
-            "history": db_row["history"],
-            "story_text": db_row.get("story_text", ""),
-            "state": db_row.get("state") or copy.deepcopy(DEFAULT_STATE),
-        }
-        session = sessions[req.session_id]
 
-    return {"story": build_transcript(session["history"])}
+def messages_to_fold(history: list[dict]) -> list[dict]:
+    """
+    Live (unsummarised) turn messages that should be folded into the summary,
+    or [] if the history is still short enough.
+    """
+    start = 2 if _has_summary(history) else 1
+    live = [m for m in history[start:] if not m.get("summarized")]
+    if len(live) <= 2 * HISTORY_MAX_TURNS:
+        return []
+    return live[:-2 * HISTORY_KEEP_TURNS]
+
+
+async def compact_history(session_id: str, session: dict) -> None:
+    history = session["history"]
+    to_fold = messages_to_fold(history)
+    if not to_fold or session.get("compacting"):
+        return
+
+    session["compacting"] = True
+    try:
+        parts = [SUMMARY_INSTRUCTIONS]
+        if _has_summary(history):
+            parts.append(history[1]["content"])
+        parts.extend(m["_transcript_line"] for m in to_fold if m["_transcript_line"])
+        parts.append("Summary:")
+
+        try:
+            summary = await call_ollama("\n\n".join(parts), model="gemma3:latest")
+        except HTTPException:
+            return  # try again after the next turn
+        if not summary.strip():
+            return
+
+        async with session_lock(session_id):
+            # Skip if the session was replaced (new story) or evicted meanwhile.
+            if sessions.get(session_id) is not session:
+                return
+
+            summary_msg = make_message("system", f"Story so far: {summary.strip()}")
+            summary_msg["summary"] = True
+            if _has_summary(history):
+                history[1] = summary_msg
+            else:
+                history.insert(1, summary_msg)
+            for msg in to_fold:
+                msg["summarized"] = True
+                msg["_chat"] = None
+
+            mark_dirty(session_id, session)
+    except Exception:
+        # Nothing awaits this task, so log here rather than lose the error.
+        logger.exception("Compacting session %s failed", session_id)
+    finally:
+        session["compacting"] = False
+
+
+def schedule_compaction(session_id: str, session: dict) -> None:
+    if not messages_to_fold(session["history"]) or session.get("compacting"):
+        return
+    task = asyncio.create_task(compact_history(session_id, session))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
 
 
 @app.post("/api/story/new")
 async def story_new(req: StoryNewRequest):
+    # Initialize state ONCE
+    state = fresh_state()
+
     # Initialize session
     history = [
-        {"role": "system", "content": SYSTEM_PROMPT.strip()},
-        {"role": "user", "content": "Start a new dark fantasy adventure with a strong hook."},
+        make_message("system", SYSTEM_PROMPT),
+        make_message("user", "Start a new dark fantasy adventure with a strong hook."),
     ]
-    
-    # Initialize state ONCE
-    state = copy.deepcopy(DEFAULT_STATE)
+    bake_state(history, state)
 
-    # Build prompt + generate
-    prompt = build_prompt(history, state)
-    story = await call_ollama(prompt, model="gemma3:latest")
+    # Generate
+    story = await call_ollama_chat(chat_messages(history), model="gemma3:latest")
 
-    # Save assistant reply
-    history.append({"role": "assistant", "content": story})
-    
     # Save to in-memory and DB
-    sessions[req.session_id] = {
-        "history": history,
-        "story_text": story,
-        "state": state,
-    }
+    session = start_session(req.session_id, history, state, story)
+    mark_dirty(req.session_id, session)
 
-    save_session(req.session_id, history, story, state)
+    return {"story": session["transcript"]}
 
-    return {"story": build_transcript(history)}
 
+async def play_turn(req: StoryTurnRequest) -> str:
+    async with session_lock(req.session_id):
+        # Re-read the session: another turn may have run while we waited.
+        session = get_session(req.session_id)
+        if not session:
+            raise HTTPException(status_code=400, detail="Session not found. Click 'New Story' first.")
 
-@app.post("/api/story/turn")
-async def story_turn(req: StoryTurnRequest):
-    # Retrieve session
-    session = sessions.get(req.session_id)
-    if not session:
-        raise HTTPException(status_code=400, detail="Session not found. Click 'New Story' first.")
+        # Ensure state exists
+        if "state" not in session:
+            session["state"] = fresh_state()
 
-    # Ensure state exists
-    session.setdefault("state", copy.deepcopy(DEFAULT_STATE))
-    
-    history = session["history"]
-    history.append({"role": "user", "content": req.action})
+        # Generate (the action joins the history with the reply)
+        user_msg = make_message("user", req.action)
+        story = await call_ollama_chat(chat_messages(session["history"] + [user_msg]), model="gemma3:latest")
 
-    # Build prompt + generate
-    prompt = build_prompt(history, session["state"])
-    story = await call_ollama(prompt, model="gemma3:latest")
+        # New stories don't take the lock, so one may have replaced this
+        # session meanwhile (as in compact_history). Drop the reply rather
+        # than saving the old story over the new one.
+        current = get_session(req.session_id)
+        if current is not session:
+            return current["transcript"] if current else ""
 
-    # Save assistant reply
-    history.append({"role": "assistant", "content": story})
-    session["story_text"] = story
+        record_turn(session, user_msg, story)
+        mark_dirty(req.session_id, session)
 
-    save_session(req.session_id, history, story, session["state"])
+        schedule_compaction(req.session_id, session)
+        return session["transcript"]
 
-    return {"story": build_transcript(history)}
+
+@app.post("/api/story/turn")
+async def story_turn(req: StoryTurnRequest):
+    # Retrieve session
+    if not get_session(req.session_id):
+        raise HTTPException(status_code=400, detail="Session not found. Click 'New Story' first.")
+
+    story = await run_once(turn_key(req.session_id, req.action), lambda: play_turn(req))
+    return {"story": story}
 
 
 @app.post("/api/story/new_stream")
 async def story_new_stream(req: StoryNewRequest):
+    state = fresh_state()
+
     history = [
-        {"role": "system", "content": SYSTEM_PROMPT.strip()},
-        {"role": "user", "content": "Start a new dark fantasy adventure with a strong hook."},
+        make_message("system", SYSTEM_PROMPT),
+        make_message("user", "Start a new dark fantasy adventure with a strong hook."),
     ]
-    
-    state = copy.deepcopy(DEFAULT_STATE)
+    bake_state(history, state)
 
-    prompt = build_prompt(history, state)
+    messages = chat_messages(history)
 
     async def ndjson_gen():
         assistant_text = ""
-
-        # Stream chunks
-        async for chunk in stream_ollama(prompt, model="gemma3:latest"):
-            assistant_text += chunk
-            yield json.dumps({"type": "chunk", "text": chunk}) + "\n"
-
-        # Save to session
-        history.append({"role": "assistant", "content": assistant_text})
-        sessions[req.session_id] = {
-            "history": history,
-            "story_text": assistant_text,
-            "state": state,
-        }
-
-        save_session(req.session_id, history, assistant_text, state)
-
-        final_story = build_transcript(history)
-        yield json.dumps({"type": "final", "story": final_story}) + "\n"
+        finished = False
+
+        # Stream chunks. If the client goes away mid-stream, whatever was
+        # generated is still kept.
+        try:
+            async for chunk in batch_chunks(stream_ollama_chat(messages, model="gemma3:latest")):
+                assistant_text += chunk
+                yield orjson.dumps({"type": "chunk", "text": chunk}) + b"\n"
+            finished = True
+        finally:
+            if finished or assistant_text:
+                session = start_session(req.session_id, history, state, assistant_text)
+                mark_dirty(req.session_id, session)
+
+        yield orjson.dumps({"type": "final", "story": session["transcript"]}) + b"\n"
 
     return StreamingResponse(ndjson_gen(), media_type="application/x-ndjson")
 
 
 @app.post("/api/story/turn_stream")
 async def story_turn_stream(req: StoryTurnRequest):
-    session = sessions.get(req.session_id)
-    if not session:
+    if not get_session(req.session_id):
         raise HTTPException(status_code=400, detail="Session not found. Click 'New Story' first.")
-    
-    session.setdefault("state", copy.deepcopy(DEFAULT_STATE))
-
-    history = session["history"]
-    prompt = build_prompt(history, session["state"])
-    
-    history.append({"role": "user", "content": req.action})
-    prompt = build_prompt(history, session["state"])
 
     async def ndjson_gen():
-        assistant_text = ""
-
-        async for chunk in stream_ollama(prompt, model="gemma3:latest"):
-            assistant_text += chunk
-            yield json.dumps({"type": "chunk", "text": chunk}) + "\n"
-
-        history.append({"role": "assistant", "content": assistant_text})
-        session["story_text"] = assistant_text
-
-        save_session(req.session_id, history, assistant_text, session["state"])
-
-        final_story = build_transcript(history)
-        yield json.dumps({"type": "final", "story": final_story}) + "\n"
+        # Held for the whole stream; taken inside the generator so a response
+        # that never starts never takes it.
+        async with session_lock(req.session_id):
+            session = get_session(req.session_id)
+            if not session:
+                return
+            if "state" not in session:
+                session["state"] = fresh_state()
+
+            user_msg = make_message("user", req.action)
+            messages = chat_messages(session["history"] + [user_msg])
+
+            assistant_text = ""
+            finished = False
+
+            # See story_new_stream: a partial reply is kept if the client disconnects.
+            try:
+                async for chunk in batch_chunks(stream_ollama_chat(messages, model="gemma3:latest")):
+                    assistant_text += chunk
+                    yield orjson.dumps({"type": "chunk", "text": chunk}) + b"\n"
+                finished = True
+            finally:
+                # See play_turn: a reply to a replaced session is dropped.
+                current = get_session(req.session_id)
+                if (finished or assistant_text) and current is session:
+                    record_turn(session, user_msg, assistant_text)
+                    mark_dirty(req.session_id, session)
+
+            if current is session:
+                schedule_compaction(req.session_id, session)
+
+        yield orjson.dumps({"type": "final", "story": (current or session)["transcript"]}) + b"\n"
 
     return StreamingResponse(ndjson_gen(), media_type="application/x-ndjson")
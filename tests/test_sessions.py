@@ -0,0 +1,99 @@
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+
+import app.db as db
+
+# Keep the test DB out of data/; must happen before the first connection.
+_TMP = tempfile.TemporaryDirectory()
+db.DATA_DIR = Path(_TMP.name)
+db.DB_PATH = db.DATA_DIR / "test.db"
+
+import app.main as main  # noqa: E402
+
+
+def tearDownModule():
+    _TMP.cleanup()
+
+
+def new_session(session_id: str) -> dict:
+    state = db.fresh_state()
+    history = [main.make_message("system", main.SYSTEM_PROMPT), main.make_message("user", "start")]
+    main.bake_state(history, state)
+    return main.start_session(session_id, history, state, "Opening.")
+
+
+class SessionTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self._max_sessions = main.MAX_SESSIONS
+        self._call_ollama_chat = main.call_ollama_chat
+        main.sessions.clear()
+        main._dirty.clear()
+
+    def tearDown(self):
+        main.MAX_SESSIONS = self._max_sessions
+        main.call_ollama_chat = self._call_ollama_chat
+        main.sessions.clear()
+        main._dirty.clear()
+
+    async def start_blocked_turn(self, session_id: str, action: str, reply: str):
+        """
+        Start a turn whose model call waits until the returned event is set.
+        """
+        started, release = asyncio.Event(), asyncio.Event()
+
+        async def fake_chat(messages, model):
+            started.set()
+            await release.wait()
+            return reply
+
+        main.call_ollama_chat = fake_chat
+        turn = asyncio.create_task(main.play_turn(main.StoryTurnRequest(session_id=session_id, action=action)))
+        await started.wait()
+        return turn, release
+
+
+class EvictionDuringTurnTest(SessionTestCase):
+    async def test_session_is_not_evicted_while_its_turn_runs(self):
+        main.MAX_SESSIONS = 1
+        main.mark_dirty("a", new_session("a"))
+        await main.flush_sessions()
+
+        turn, release = await self.start_blocked_turn("a", "A", "Reply A.")
+
+        # Another session pushes "a" over MAX_SESSIONS, and "a" is read
+        # while its turn is still waiting on the model.
+        main.mark_dirty("b", new_session("b"))
+        in_turn = main.get_session("a")
+
+        release.set()
+        await turn
+        await main.flush_sessions()
+
+        self.assertIs(main.get_session("a"), in_turn)
+        self.assertEqual(main.get_session("a")["history"][-1]["content"], "Reply A.")
+        self.assertEqual(db.load_session("a")["history"][-1]["content"], "Reply A.")
+
+
+class NewStoryDuringTurnTest(SessionTestCase):
+    async def test_turn_on_replaced_session_is_dropped(self):
+        main.mark_dirty("a", new_session("a"))
+        await main.flush_sessions()
+
+        turn, release = await self.start_blocked_turn("a", "A", "Reply A.")
+
+        # "New Story" replaces the session while the old turn is running.
+        replacement = new_session("a")
+        main.mark_dirty("a", replacement)
+
+        release.set()
+        self.assertEqual(await turn, replacement["transcript"])
+        await main.flush_sessions()
+
+        self.assertIs(main.get_session("a"), replacement)
+        self.assertEqual(len(db.load_session("a")["history"]), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()